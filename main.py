@@ -1,51 +1,185 @@
 
+import argparse
+import math
+import mmap
+import os
+import stat
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
 from PIL import Image
 
+# 超过该大小的文件使用mmap读取
+MMAP_THRESHOLD = 64 * 1024
+# 图片开头用8字节大端整数记录原始文件长度
+HEADER_FORMAT = '>Q'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# 文件内容基本不可压缩，PNG使用最低压缩等级以换取保存速度
+PNG_SAVE_OPTIONS = {'compress_level': 1, 'optimize': False}
+# 图片宽度向上取整到该值的倍数，使每行像素对齐，便于PNG的行过滤做向量化处理
+ROW_ALIGNMENT = 16
+# 只允许无损格式，有损格式会破坏编码在像素中的文件数据
+LOSSLESS_FORMATS = ('PNG', 'BMP', 'TIFF')
+# Pillow默认拒绝打开超过Image.MAX_IMAGE_PIXELS（约8950万像素，对应约268MB的文件）的图片，
+# 以防解压炸弹，而file_to_image生成图片时不受该限制。解码时只在读取图片期间临时取消该限制，
+# 修改的是Pillow的全局设置，所以用锁保证并发解码时能正确恢复
+_max_image_pixels_lock = threading.Lock()
+
+
+def find_optimal_dimensions(min_pixels):
+    # 返回至少能容纳min_pixels个像素、尽量接近正方形的图片尺寸(width, height)
+    # 不要求width*height恰好等于min_pixels，多出的像素由调用方补零
+    # 空文件也至少生成1x1的图片
+    min_pixels = max(min_pixels, 1)
+    width = math.isqrt(min_pixels - 1) + 1
+    width = (width + ROW_ALIGNMENT - 1) // ROW_ALIGNMENT * ROW_ALIGNMENT
+    height = (min_pixels + width - 1) // width
+    return width, height
+
 
-def file_to_image(file_path, output_image_path):
-    # 读取文件内容
+def file_to_image(file_path, output_image_path, image_format=None):
+    # 未指定格式时和Pillow一样按输出文件扩展名推断
+    if image_format is None:
+        extension = os.path.splitext(output_image_path)[1].lower()
+        image_format = Image.registered_extensions().get(extension)
+    if image_format is None or image_format.upper() not in LOSSLESS_FORMATS:
+        raise ValueError(f'不支持的图片格式: {image_format}，只支持{"/".join(LOSSLESS_FORMATS)}')
+    image_format = image_format.upper()
     with open(file_path, 'rb') as file:
-        file_data = file.read()
-    # 将文件内容转换为16进制
-    hex_data = file_data.hex()
-    # 确定图片尺寸
-    # 每个像素的RGB通道可以存储6位16进制数据，所以每个像素可以存储18位文件数据
-    pixel_count = len(hex_data) // 3
-    width = int(pixel_count ** 0.5)
-    height= (int(pixel_count / width)/2)+1
-    width,height=round(width),round(height)
-    # 创建一个新的图片
-    img = Image.new('RGB', (width, height))
-    # 将16进制数据编码到图片的RGB通道中
-    pixel_index = 0
-    for y in range(height):
-        for x in range(width):
-            if pixel_index < len(hex_data):
-             try:
-                r = int(hex_data[pixel_index:pixel_index+2], 16)
-                g = int(hex_data[pixel_index+2:pixel_index+4], 16)
-                b = int(hex_data[pixel_index+4:pixel_index+6], 16)
-                img.putpixel((x, y), (r, g, b))
-                pixel_index += 3*2
-             except Exception:break;break
-            else:
-                img.putpixel((x, y), (0, 0, 0))
-
-    # 保存图片
-    img.save(output_image_path)
+        file_stat = os.fstat(file.fileno())
+        if stat.S_ISREG(file_stat.st_mode):
+            file_size = file_stat.st_size
+            file_data = None
+        else:
+            # 管道、/dev/stdin等非普通文件无法预先得知大小，也不能mmap，只能整体读入
+            file_data = file.read()
+            file_size = len(file_data)
+        # 确定图片尺寸
+        # 每个像素的RGB通道可以存储3个字节的数据（长度头 + 文件内容）
+        data_size = HEADER_SIZE + file_size
+        width, height = find_optimal_dimensions((data_size + 2) // 3)
+        # 按图片形状预分配补零的像素缓冲区，写入长度头后把文件内容直接读进缓冲区
+        # 不拼接长度头和文件内容，避免峰值内存翻倍；大文件通过mmap直接拷贝
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        flat_pixels = pixels.reshape(-1)
+        struct.pack_into(HEADER_FORMAT, flat_pixels, 0, file_size)
+        if file_data is not None:
+            flat_pixels[HEADER_SIZE:data_size] = np.frombuffer(file_data, dtype=np.uint8)
+        elif file_size > MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # 文件在fstat之后被修改时长度头会与实际内容不符
+                if len(mm) != file_size:
+                    raise OSError(f'{file_path}在读取过程中大小发生变化')
+                flat_pixels[HEADER_SIZE:data_size] = np.frombuffer(mm, dtype=np.uint8)
+        else:
+            read_size = file.readinto(flat_pixels[HEADER_SIZE:data_size])
+            if read_size != file_size:
+                raise OSError(f'{file_path}在读取过程中大小发生变化')
+    # 将像素缓冲区转换为RGB图片
+    img = Image.fromarray(pixels)
+    # 保存图片，需要纯吞吐时可以使用不压缩的BMP格式
+    save_options = PNG_SAVE_OPTIONS if image_format == 'PNG' else {}
+    img.save(output_image_path, image_format, **save_options)
+
+
+def batch_file_to_image(file_paths, output_dir, workers=None, image_format='PNG'):
+    # 多线程批量编码，输出文件名为原文件名加图片扩展名
+    # Pillow保存图片和numpy整块拷贝时会释放GIL，所以线程数可以随CPU核数扩展
+    # 任一文件编码失败时，异常会在所有任务结束后抛给调用方
+    if workers is None:
+        workers = os.cpu_count()
+    output_paths = [
+        os.path.join(output_dir, f'{os.path.basename(file_path)}.{image_format.lower()}')
+        for file_path in file_paths
+    ]
+    # 不同目录下的同名文件会输出到同一路径，提交任务前先检查，避免互相覆盖
+    seen_paths = {}
+    for file_path, output_path in zip(file_paths, output_paths):
+        key = os.path.normcase(output_path)
+        if key in seen_paths:
+            raise ValueError(f'{seen_paths[key]}和{file_path}的输出路径重复: {output_path}')
+        seen_paths[key] = file_path
+    os.makedirs(output_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(file_to_image, file_path, output_path, image_format)
+            for file_path, output_path in zip(file_paths, output_paths)
+        ]
+    for future in futures:
+        future.result()
+    return output_paths
+
+
+@contextmanager
+def _unlimited_image_pixels():
+    # 在with块内取消Image.MAX_IMAGE_PIXELS限制；TIFF在加载像素时也会检查，所以要覆盖整个读取过程
+    with _max_image_pixels_lock:
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+
 def image_to_file(image_path, output_file_path):
     # 加载图片
-    img = Image.open(image_path)
-    # 从图片的RGB通道中提取16进制数据
-    hex_data = ''
-    for pixel in img.getdata():
-        r, g, b = pixel
-        hex_data += f'{r:02x}{g:02x}{b:02x}'
-    # 将16进制数据转换为原始文件数据
-    hex_data=hex_data.rstrip('0')
-    file_data = bytes.fromhex(hex_data)
-    # 保存文件
+    with _unlimited_image_pixels(), Image.open(image_path) as img:
+        # 编码时只会生成RGB图片，其他模式的通道排列不同，解码出来的数据没有意义
+        if img.mode != 'RGB':
+            raise ValueError(f'图片模式必须为RGB，实际为{img.mode}')
+        # np.asarray通过__array_interface__调用tobytes()，会把整个像素平面完整拷贝一份，
+        # 并不是零拷贝视图；正因为是拷贝，图片在with块结束关闭后数组仍然有效
+        pixels = np.asarray(img).reshape(-1)
+    if pixels.size < HEADER_SIZE:
+        raise ValueError('图片过小，缺少长度头')
+    (file_size,) = struct.unpack_from(HEADER_FORMAT, pixels, 0)
+    # 长度头超出图片容量说明图片被截断或并非由file_to_image生成
+    if HEADER_SIZE + file_size > pixels.size:
+        raise ValueError(f'长度头记录的文件大小{file_size}超出图片容量')
+    # 按长度头截取原始文件数据
+    file_data = pixels[HEADER_SIZE:HEADER_SIZE + file_size]
+    # 保存文件，直接写出数组切片，不再额外拷贝一份bytes
     with open(output_file_path, 'wb') as file:
         file.write(file_data)
+
+
+def positive_int(value):
+    # argparse参数类型：正整数
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'必须为正整数: {value}')
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将文件编码为图片，或从图片还原文件')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    encode_parser = subparsers.add_parser('encode', help='将文件编码为图片')
+    encode_parser.add_argument('file_path')
+    encode_parser.add_argument('output_image_path')
+    encode_parser.add_argument('--format', dest='image_format', choices=LOSSLESS_FORMATS)
+    batch_parser = subparsers.add_parser('batch', help='将多个文件批量编码为图片')
+    batch_parser.add_argument('file_paths', nargs='+')
+    batch_parser.add_argument('--output-dir', required=True)
+    batch_parser.add_argument('--workers', type=positive_int)
+    batch_parser.add_argument('--format', dest='image_format', default='PNG',
+                              choices=LOSSLESS_FORMATS)
+    decode_parser = subparsers.add_parser('decode', help='从图片还原文件')
+    decode_parser.add_argument('image_path')
+    decode_parser.add_argument('output_file_path')
+    args = parser.parse_args()
+    if args.command == 'encode':
+        file_to_image(args.file_path, args.output_image_path, args.image_format)
+    elif args.command == 'batch':
+        batch_file_to_image(args.file_paths, args.output_dir, args.workers, args.image_format)
+    else:
+        image_to_file(args.image_path, args.output_file_path)
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import argparse
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from PIL import Image
+
+import main
+
+
+def round_trip(tmp_path, data, image_name='encoded.png', image_format=None):
+    input_path = tmp_path / 'input.bin'
+    image_path = tmp_path / image_name
+    output_path = tmp_path / 'output.bin'
+    input_path.write_bytes(data)
+    main.file_to_image(str(input_path), str(image_path), image_format)
+    main.image_to_file(str(image_path), str(output_path))
+    return output_path.read_bytes()
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'a',
+    b'hello\x00\x00',
+    b'\x00' * 10,
+    os.urandom(main.MMAP_THRESHOLD + 1),
+    os.urandom(main.MMAP_THRESHOLD * 3 + 7) + b'\x00',
+], ids=['empty', 'one-byte', 'trailing-zeros', 'all-zeros', 'mmap', 'mmap-trailing-zero'])
+def test_round_trip(tmp_path, data):
+    assert round_trip(tmp_path, data) == data
+
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason='需要支持FIFO的平台')
+def test_round_trip_from_fifo(tmp_path):
+    data = b'hello world' * 10000
+    fifo_path = tmp_path / 'input.fifo'
+    os.mkfifo(fifo_path)
+    writer = threading.Thread(target=(lambda: fifo_path.write_bytes(data)))
+    writer.start()
+    main.file_to_image(str(fifo_path), str(tmp_path / 'encoded.png'))
+    writer.join()
+    main.image_to_file(str(tmp_path / 'encoded.png'), str(tmp_path / 'output.bin'))
+    assert (tmp_path / 'output.bin').read_bytes() == data
+
+
+@pytest.mark.parametrize('size', [100, main.MMAP_THRESHOLD + 1], ids=['readinto', 'mmap'])
+def test_file_size_changed_during_read(tmp_path, monkeypatch, size):
+    input_path = tmp_path / 'input.bin'
+    input_path.write_bytes(b'x' * size)
+    real_fstat = os.fstat
+
+    # 模拟文件在fstat之后被截断：fstat报告的大小比实际内容多一个字节
+    def grown_fstat(fd):
+        result = list(real_fstat(fd))
+        result[6] += 1
+        return os.stat_result(result)
+
+    monkeypatch.setattr(main.os, 'fstat', grown_fstat)
+    with pytest.raises(OSError):
+        main.file_to_image(str(input_path), str(tmp_path / 'encoded.png'))
+
+@pytest.mark.parametrize('image_name, image_format, magic', [
+    ('encoded.bmp', None, b'BM'),
+    ('encoded.tif', None, b'II'),
+    ('encoded.png', 'BMP', b'BM'),
+])
+def test_image_format(tmp_path, image_name, image_format, magic):
+    data = os.urandom(1000)
+    assert round_trip(tmp_path, data, image_name, image_format) == data
+    assert (tmp_path / image_name).read_bytes()[:2] == magic
+
+
+
+@pytest.mark.parametrize('image_name', ['encoded.png', 'encoded.bmp', 'encoded.tif'])
+def test_decode_ignores_max_image_pixels(tmp_path, monkeypatch, image_name):
+    # 7000字节需要约2300个像素，超过这里设置的上限
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    data = os.urandom(7000)
+    assert round_trip(tmp_path, data, image_name) == data
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+@pytest.mark.parametrize('image_name, image_format', [
+    ('encoded.jpg', None),
+    ('encoded.png', 'JPEG'),
+    ('encoded', None),
+])
+def test_lossy_or_unknown_format_rejected(tmp_path, image_name, image_format):
+    input_path = tmp_path / 'input.bin'
+    input_path.write_bytes(b'data')
+    with pytest.raises(ValueError):
+        main.file_to_image(str(input_path), str(tmp_path / image_name), image_format)
+
+
+def test_find_optimal_dimensions():
+    for min_pixels in [0, 1, 16, 17, 257, 10 ** 6 + 3]:
+        width, height = main.find_optimal_dimensions(min_pixels)
+        assert width % main.ROW_ALIGNMENT == 0
+        assert width * height >= min_pixels
+
+
+def test_non_rgb_image_rejected(tmp_path):
+    image_path = tmp_path / 'rgba.png'
+    Image.new('RGBA', (16, 16), (1, 2, 3, 4)).save(image_path)
+    with pytest.raises(ValueError):
+        main.image_to_file(str(image_path), str(tmp_path / 'output.bin'))
+
+
+def test_oversized_length_header_rejected(tmp_path):
+    image_path = tmp_path / 'foreign.png'
+    Image.new('RGB', (16, 16), (255, 255, 255)).save(image_path)
+    with pytest.raises(ValueError):
+        main.image_to_file(str(image_path), str(tmp_path / 'output.bin'))
+
+
+def test_batch_file_to_image(tmp_path):
+    inputs = []
+    for name in ['a.txt', 'b.bin']:
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 100)
+        inputs.append(str(path))
+    output_dir = tmp_path / 'out'
+    output_paths = main.batch_file_to_image(inputs, str(output_dir), workers=2)
+    assert output_paths == [str(output_dir / 'a.txt.png'), str(output_dir / 'b.bin.png')]
+    for input_path, output_path in zip(inputs, output_paths):
+        decoded_path = tmp_path / 'decoded'
+        main.image_to_file(output_path, str(decoded_path))
+        assert decoded_path.read_bytes() == Path(input_path).read_bytes()
+
+
+def test_batch_duplicate_output_rejected(tmp_path):
+    inputs = []
+    for directory in ['a', 'b']:
+        (tmp_path / directory).mkdir()
+        path = tmp_path / directory / 'f'
+        path.write_bytes(directory.encode())
+        inputs.append(str(path))
+    output_dir = tmp_path / 'out'
+    with pytest.raises(ValueError):
+        main.batch_file_to_image(inputs, str(output_dir))
+    assert not output_dir.exists()
+
+
+def run_cli(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['main.py', *map(str, args)])
+    main.main()
+
+
+def test_cli_encode_decode(tmp_path, monkeypatch):
+    data = os.urandom(1000) + b'\x00'
+    input_path = tmp_path / 'input.bin'
+    input_path.write_bytes(data)
+    run_cli(monkeypatch, 'encode', input_path, tmp_path / 'encoded.png', '--format', 'BMP')
+    assert (tmp_path / 'encoded.png').read_bytes()[:2] == b'BM'
+    run_cli(monkeypatch, 'decode', tmp_path / 'encoded.png', tmp_path / 'output.bin')
+    assert (tmp_path / 'output.bin').read_bytes() == data
+
+
+def test_cli_batch(tmp_path, monkeypatch):
+    inputs = []
+    for name in ['a.txt', 'b.bin']:
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 100)
+        inputs.append(path)
+    output_dir = tmp_path / 'out'
+    run_cli(monkeypatch, 'batch', *inputs, '--output-dir', output_dir,
+            '--workers', '2', '--format', 'TIFF')
+    for input_path in inputs:
+        run_cli(monkeypatch, 'decode', output_dir / f'{input_path.name}.tiff',
+                tmp_path / 'decoded')
+        assert (tmp_path / 'decoded').read_bytes() == input_path.read_bytes()
+
+
+@pytest.mark.parametrize('args', [
+    ['encode', 'input.bin', 'encoded.jpg', '--format', 'JPEG'],
+    ['batch', 'input.bin', '--output-dir', 'out', '--format', 'JPEG'],
+    ['batch', 'input.bin', '--output-dir', 'out', '--workers', '0'],
+    ['batch', 'input.bin', '--output-dir', 'out', '--workers', '-1'],
+    ['batch', 'input.bin', '--output-dir', 'out', '--workers', 'abc'],
+])
+def test_cli_invalid_arguments(monkeypatch, args):
+    with pytest.raises(SystemExit) as excinfo:
+        run_cli(monkeypatch, *args)
+    assert excinfo.value.code == 2
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'abc'])
+def test_positive_int_rejects(value):
+    with pytest.raises((argparse.ArgumentTypeError, ValueError)):
+        main.positive_int(value)
+
+
+def test_positive_int_accepts():
+    assert main.positive_int('3') == 3